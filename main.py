@@ -1,4 +1,5 @@
 import os
+import json
 import dht
 import time
 import socket
@@ -6,6 +7,8 @@ import machine
 import network
 import ntptime
 import sensors
+import memory
+import schedule
 from config import CONFIG
 from utils import retry
 
@@ -32,9 +35,14 @@ FIELD_NAME_TRANSLATION = {
 
 MAX_LOG_SIZE = 10000
 
+# uploads failed more often are retried in the next cycle
+MAX_SEND_TRIES = 5
+
 # Micropython uses seconds since 2000 instead since 1970
 UNIX_EPOCH_DELTA = 946684800
 
+MEMORY = memory.MemoryTracker()
+
 
 def log(msg, level='INFO'):
     now = "{:0>4}-{:0>2}-{:0>2} {:0>2}:{:0>2}:{:0>2}".format(*time.localtime())
@@ -84,6 +92,16 @@ def setup_network_and_time():
     ntptime.settime()
 
 
+def get_slot_offset():
+    """Return offset of this node's upload slot within the update period,
+    derived from the MAC address (or location if MAC is not available)."""
+    try:
+        key = network.WLAN(network.STA_IF).config('mac')
+    except Exception:
+        key = CONFIG.location
+    return schedule.slot_offset(key, CONFIG.update_period)
+
+
 def get_wifi_signal():
     """Return RSSI of used wifi."""
     if not CONFIG.enable_wifi_signal:
@@ -92,12 +110,13 @@ def get_wifi_signal():
     sta_if = network.WLAN(network.STA_IF)
     scan = sta_if.scan()
     wifi = [wifi for wifi in scan if wifi[0].decode('ascii') == CONFIG.wifi_ssid]
+    # scan list might be large, free it as soon as possible
+    del scan
     if len(wifi) != 1:
         log("Error: scan ")
         return float('nan')
-    wifi = wifi[0]
 
-    wifi_signal = wifi[3]
+    wifi_signal = wifi[0][3]
     return wifi_signal
 
 
@@ -145,11 +164,18 @@ def translate_field_names(fields, api_name):
             for name, value in fields.items()}
 
 
-def send_data(fields):
+def send_data(fields, slot_offset):
+    """Send data to server, return seconds to wait if server asks to back
+    off (HTTP 429/503), None otherwise."""
     # TODO use retry decorator
-    for _ in range(10):
+    for attempt in range(MAX_SEND_TRIES):
         try:
             answer = http_get(generate_api_uri(**fields))
+            backoff = schedule.parse_backoff(answer)
+            if backoff is not None:
+                log("Server busy, not retrying, server asks to back off "
+                    "for {}s.".format(backoff))
+                return backoff
             if (answer.startswith('HTTP/1.1 200 OK')):
                 log("Sent data to server: {}".format(fields))
             else:
@@ -162,24 +188,107 @@ def send_data(fields):
             log(e)
         else:
             break
-        time.sleep(3)
+        if attempt < MAX_SEND_TRIES - 1:
+            time.sleep(schedule.retry_delay(attempt, slot_offset))
     else:
         log("Failed storing data, not retrying more often until next "
             "measurement.")
 
 
-def good_night():
-    log("Good night!")
+def read_rtc_memory():
+    """Return state kept in RTC memory during deep sleep."""
+    try:
+        return json.loads(machine.RTC().memory())
+    except ValueError:
+        # empty or garbage after power up
+        return {}
+
+
+def write_rtc_memory(state):
+    machine.RTC().memory(json.dumps(state))
+
+
+def good_night(sleep_s, resumed=False):
+    log("Good night! Sleeping for {}s...".format(sleep_s))
+    state = read_rtc_memory()
+    alarm_s, remaining_s = schedule.split_sleep(sleep_s,
+                                                state.get('factor', 1.))
+    if resumed:
+        state['alarm'] = state.get('alarm', 0) + alarm_s
+    else:
+        # time is synced via NTP, used to measure the speed of the RTC
+        state['start'] = time.time()
+        state['alarm'] = alarm_s
+    state['remaining'] = remaining_s
+    write_rtc_memory(state)
     rtc = machine.RTC()
     rtc.irq(trigger=rtc.ALARM0, wake=machine.DEEPSLEEP)
-    rtc.alarm(rtc.ALARM0, CONFIG.update_period * 1000)
+    rtc.alarm(rtc.ALARM0, alarm_s * 1000)
     machine.deepsleep()
 
 
+def resume_sleep():
+    """Continue sleeping if woken up by the alarm before the end of a sleep
+    longer than the RTC alarm can cover."""
+    if machine.reset_cause() != machine.DEEPSLEEP_RESET:
+        return
+    remaining_s = read_rtc_memory().get('remaining', 0)
+    if remaining_s > 0:
+        good_night(remaining_s, resumed=True)
+
+
+def calibrate_rtc():
+    """Measure the speed of the RTC after waking up from deep sleep and
+    syncing time via NTP, so that the next alarm fires at the slot."""
+    if machine.reset_cause() != machine.DEEPSLEEP_RESET:
+        return
+    state = read_rtc_memory()
+    if 'start' not in state:
+        return
+    # time since boot was not spent sleeping
+    slept_s = time.time() - state.pop('start') - time.ticks_ms() // 1000
+    state['factor'] = schedule.rtc_factor(slept_s, state.get('alarm', 0),
+                                          state.get('factor', 1.))
+    log("RTC speed: {:.4f}s per alarm second".format(state['factor']))
+    write_rtc_memory(state)
+
+
+def allow_reflash():
+    if machine.reset_cause() != machine.DEEPSLEEP_RESET:
+        # allows easier reflashing if done in 30s after powerup
+        log("Wait 10s...")
+        time.sleep(10)
+
+
+def wait_for_slot(slot_offset):
+    """Wait for the upload slot unless woken up by the alarm at it, i.e.
+    after power up, reset or a long wait for the network."""
+    if CONFIG.sleep_between_measurements:
+        # before checking the slot, the node might reach it while waiting
+        allow_reflash()
+    wait = schedule.seconds_until_start(time.time(), CONFIG.update_period,
+                                        slot_offset)
+    if not wait:
+        return
+    log("Waiting {}s for upload slot...".format(wait))
+    # a short wait (e.g. woken up a bit early) is cheaper than another deep
+    # sleep, which needs to set up the network again
+    if CONFIG.sleep_between_measurements and \
+            wait >= schedule.slot_tolerance(CONFIG.update_period):
+        good_night(wait)
+    time.sleep(wait)
+
+
 def main():
+    memory.setup_gc()
+    # discard phases of a cycle aborted by an exception
+    MEMORY.reset()
+    # before setting up the network, which is not needed for sleeping on
+    resume_sleep()
     CONFIG.read()
 
     setup_network_and_time()
+    calibrate_rtc()
 
     dht_sensor = sensors.Dht(
         CONFIG.sensor_dht_pin, CONFIG.sensor_dht_type,
@@ -188,33 +297,55 @@ def main():
     ds18b20_sensor = sensors.Ds18x20(CONFIG.sensor_ds18x20_pin,
                                      CONFIG.ds18b20_temp_calibration)
 
+    slot_offset = get_slot_offset()
+    log("Upload slot at {}s within period of {}s".format(
+        slot_offset, CONFIG.update_period))
+
+    MEMORY.checkpoint('setup')
+    log("Memory: {}".format(MEMORY.summary()))
+    MEMORY.reset()
+
+    wait_for_slot(slot_offset)
+
     while True:
         fields = {
             'temperature1': dht_sensor.temperature(),
             'temperature2': ds18b20_sensor.temperature(),
             'humidity': dht_sensor.humidity(),
-            'comment': '-',
             'time': time.time() + UNIX_EPOCH_DELTA,
             'location': CONFIG.location,
             'wifi_signal': get_wifi_signal(),
             'supply_voltage': 0  # TODO   https://forum.micropython.org/viewtopic.php?t=533
         }
-        log("Record:", fields)
+        MEMORY.checkpoint('measure')
+        # free heap headroom since startup, i.e. including this measurement
+        fields['comment'] = 'min_free={}'.format(MEMORY.min_free_total)
+        log("Record: {}".format(fields))
 
         fields_translated = translate_field_names(fields, CONFIG.api_name)
-        send_data(fields_translated)
+        backoff = send_data(fields_translated, slot_offset)
+        del fields, fields_translated
+        MEMORY.checkpoint('send')
 
-        if CONFIG.sleep_between_measurements:
-            if machine.reset_cause() != machine.DEEPSLEEP_RESET:
-                # allows easier reflashing if done in 30s after powerup
-                log("Wait 10s...")
-                time.sleep(10)
+        if MEMORY.finish():
+            log("Memory: {}".format(MEMORY.summary()))
+        else:
+            log("Low on memory: {}".format(MEMORY.summary()), level='WARNING')
+        MEMORY.reset()
 
+        if CONFIG.sleep_between_measurements:
             # in this case while loop is useless, because after wake up it will
-            # start from begin
-            good_night()
+            # start from begin, time is synced via NTP after wake up
+            good_night(schedule.next_wake(time.time(), CONFIG.update_period,
+                                          slot_offset, backoff))
         else:
-            time.sleep(CONFIG.update_period)
+            # resync to keep wakes aligned to the slot
+            try:
+                ntptime.settime()
+            except Exception as e:
+                log("Error: could not sync time via NTP: {!s}".format(e))
+            time.sleep(schedule.next_wake(time.time(), CONFIG.update_period,
+                                          slot_offset, backoff))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,127 @@
+import gc
+
+
+# lowest free heap (in bytes) during a cycle below which a warning is logged
+LOW_HEAP_WARNING = 4096
+
+# heap size assumed when simulating in CPython, roughly the free heap of an
+# ESP8266 running micropython
+SIMULATED_HEAP_SIZE = 32 * 1024
+
+# number of finished cycles kept in MemoryTracker.history
+HISTORY_LENGTH = 10
+
+
+def _traced_memory():
+    # gc.mem_alloc() and gc.mem_free() are micropython only, when running in
+    # CPython (e.g. in tests) memory allocated since first call is traced
+    import tracemalloc
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+    return tracemalloc
+
+
+def _mem_alloc():
+    try:
+        return gc.mem_alloc()
+    except AttributeError:
+        return _traced_memory().get_traced_memory()[0]
+
+
+def _mem_free():
+    try:
+        return gc.mem_free()
+    except AttributeError:
+        return SIMULATED_HEAP_SIZE - _mem_alloc()
+
+
+def _mem_free_low():
+    """Return lowest free heap since last call. Must be called before
+    collecting garbage: in micropython free heap is not known between calls,
+    but garbage not collected yet is not free either, so this includes short
+    lived peaks since the last collection. In CPython the traced peak is
+    used."""
+    try:
+        return gc.mem_free()
+    except AttributeError:
+        pass
+    tracemalloc = _traced_memory()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.reset_peak()
+    return SIMULATED_HEAP_SIZE - peak
+
+
+def setup_gc():
+    """Enable automatic garbage collection and make it trigger early, i.e.
+    after a quarter of the free heap has been allocated (recommended by the
+    micropython docs to reduce heap fragmentation)."""
+    gc.enable()
+    gc.collect()
+    if hasattr(gc, 'threshold'):
+        gc.threshold(_mem_free() // 4 + _mem_alloc())
+
+
+class MemoryTracker:
+    """Collect garbage at phase boundaries of a measurement cycle and record
+    free heap and allocated bytes for each phase.
+
+    Call checkpoint() at the end of each phase and reset() at the begin of
+    each cycle. Phases are recorded as (phase, min_free, free, allocated),
+    i.e. lowest free heap during the phase, free heap after collection and
+    bytes allocated during the phase. Minimum free heap (headroom) is tracked
+    for the current cycle and since startup, minimum free heap of the last
+    finished cycles is kept in history as list of (cycle, min_free)."""
+    def __init__(self):
+        self.collections = 0
+        self.cycles = 0
+        self.history = []
+        self.min_free_total = None
+        self.reset()
+
+    def reset(self):
+        """Start a new cycle."""
+        self.phases = []
+        self.min_free = None
+        self._collect()
+        self._last_alloc = _mem_alloc()
+        _mem_free_low()
+
+    def _collect(self):
+        gc.collect()
+        self.collections += 1
+
+    def checkpoint(self, phase):
+        """Record memory usage of the phase which just ended and collect
+        garbage. Returns lowest free heap during the phase."""
+        alloc_before = _mem_alloc()
+        min_free = _mem_free_low()
+        self._collect()
+        free = _mem_free()
+        min_free = min(min_free, free)
+        # allocated bytes still alive at the end of the phase (before
+        # collection) minus alive at its begin
+        allocated = alloc_before - self._last_alloc
+        self._last_alloc = _mem_alloc()
+
+        self.phases.append((phase, min_free, free, allocated))
+        if self.min_free is None or min_free < self.min_free:
+            self.min_free = min_free
+        if self.min_free_total is None or min_free < self.min_free_total:
+            self.min_free_total = min_free
+        return min_free
+
+    def finish(self):
+        """End the current cycle, returns True if free heap is sufficient."""
+        self.cycles += 1
+        self.history.append((self.cycles, self.min_free))
+        if len(self.history) > HISTORY_LENGTH:
+            self.history.pop(0)
+        return self.min_free is None or self.min_free >= LOW_HEAP_WARNING
+
+    def summary(self):
+        phases = ", ".join("{}={}/{}/{:+d}".format(*phase)
+                           for phase in self.phases)
+        return "min free/free/allocated per phase: {}; min free: {} (cycle), {} " \
+            "(total); cycles: {}; collections: {}".format(
+                phases, self.min_free, self.min_free_total, self.cycles,
+                self.collections)
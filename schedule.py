@@ -0,0 +1,141 @@
+# default delay if server sends 429/503 without a (parsable) Retry-After
+DEFAULT_BACKOFF_S = 60
+
+# back-off requested by the server is limited to this number of periods
+MAX_BACKOFF_PERIODS = 2
+
+# the RTC alarm of the ESP8266 cannot sleep longer than 2**32us (~71 minutes)
+MAX_ALARM_S = 4200
+
+# measured speed of the RTC (real seconds per alarm second) outside of these
+# limits is implausible and ignored
+MIN_RTC_FACTOR = 0.8
+MAX_RTC_FACTOR = 1.2
+
+# delay before the first retry of a failed upload, doubled for each retry
+RETRY_BASE_S = 3
+
+
+def slot_offset(key, period):
+    """Return a deterministic offset in seconds in [0, period) for a node
+    identified by key (bytes or str, e.g. MAC or location).
+
+    Builtin hash() is not used, because it is randomized in CPython and
+    might change between micropython versions."""
+    if isinstance(key, str):
+        key = key.encode('utf8')
+    # FNV-1a, finalized like murmur3 to spread similar keys (e.g. MACs of
+    # the same vendor which differ only in the last byte) over the period
+    h = 0x811c9dc5
+    for c in key:
+        h = ((h ^ c) * 0x01000193) & 0xffffffff
+    h ^= h >> 16
+    h = (h * 0x85ebca6b) & 0xffffffff
+    h ^= h >> 13
+    h = (h * 0xc2b2ae35) & 0xffffffff
+    h ^= h >> 16
+    return h % period
+
+
+def slot_tolerance(period):
+    """Return seconds a wake up may be off the slot, a tenth of the
+    period."""
+    return period // 10
+
+
+def seconds_until_slot(now, period, offset, min_sleep=None):
+    """Return seconds from now (NTP synced) until the next time slot.
+
+    Waiting is computed from the absolute time, so duration of the
+    measurement cycle and drift of the RTC during deep sleep (corrected by
+    NTP after wakeup) do not shift the slot. If the next slot is closer than
+    min_sleep (default: a tenth of the period), the node probably woke up a
+    bit early and already served this slot, so the one after is used."""
+    if min_sleep is None:
+        min_sleep = slot_tolerance(period)
+    wait = (offset - now) % period
+    if wait < min_sleep:
+        wait += period
+    return wait
+
+
+def seconds_until_start(now, period, offset, tolerance=None):
+    """Return seconds to wait before the first measurement after startup.
+
+    If the node was woken up by the alarm at (or slightly after) its slot,
+    i.e. less than tolerance (default: a tenth of the period) has passed
+    since the slot, 0 is returned. Otherwise (power up, reset, long wait for
+    the network) seconds until the next slot are returned."""
+    if tolerance is None:
+        tolerance = slot_tolerance(period)
+    if (now - offset) % period < tolerance:
+        return 0
+    return seconds_until_slot(now, period, offset, min_sleep=0)
+
+
+def next_wake(now, period, offset, backoff=None):
+    """Return seconds to sleep until the next slot, but not before backoff
+    seconds requested by the server have passed. Backoff is limited to
+    MAX_BACKOFF_PERIODS periods."""
+    if not backoff:
+        return seconds_until_slot(now, period, offset)
+    backoff = min(backoff, MAX_BACKOFF_PERIODS * period)
+    return backoff + seconds_until_slot(now + backoff, period, offset,
+                                        min_sleep=0)
+
+
+def split_sleep(sleep_s, factor=1.):
+    """Return (alarm_s, remaining_s), i.e. seconds to set the RTC alarm to
+    for sleeping sleep_s real seconds, limited to MAX_ALARM_S, and real
+    seconds left to sleep after waking up from the alarm. The RTC is
+    assumed to run factor real seconds per alarm second."""
+    alarm_s = int(sleep_s / factor + 0.5)
+    if alarm_s <= MAX_ALARM_S:
+        return alarm_s, 0
+    return MAX_ALARM_S, max(0, sleep_s - int(MAX_ALARM_S * factor + 0.5))
+
+
+def rtc_factor(slept_s, alarm_s, factor=1.):
+    """Return real seconds per RTC alarm second, updated by a deep sleep
+    which lasted slept_s real seconds (measured via NTP) with the alarm set
+    to alarm_s seconds. Implausible measurements are ignored, otherwise the
+    measurement is averaged with the previous factor."""
+    if alarm_s <= 0:
+        return factor
+    measured = slept_s / alarm_s
+    if not MIN_RTC_FACTOR <= measured <= MAX_RTC_FACTOR:
+        return factor
+    return (factor + measured) / 2.
+
+
+def retry_delay(attempt, offset):
+    """Return seconds to wait before retrying a failed upload for the
+    attempt-th time (starting at 0).
+
+    The delay grows exponentially and a per node share derived from the slot
+    offset is added, so nodes failing at the same time do not retry in
+    lockstep."""
+    delay = RETRY_BASE_S * 2 ** attempt
+    return delay + offset % delay
+
+
+def parse_backoff(answer):
+    """Return seconds the server asks us to wait if answer is a HTTP response
+    with status 429 or 503, None otherwise. Only the delay-seconds form of
+    Retry-After is supported."""
+    lines = answer.split('\r\n')
+    status = lines[0].split(' ')
+    if len(status) < 2 or status[1] not in ('429', '503'):
+        return None
+
+    for line in lines[1:]:
+        if not line:
+            # end of header
+            break
+        name, _, value = line.partition(':')
+        if name.strip().lower() == 'retry-after':
+            try:
+                return max(0, int(value.strip()))
+            except ValueError:
+                break
+    return DEFAULT_BACKOFF_S
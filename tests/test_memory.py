@@ -0,0 +1,153 @@
+from nose.tools import *
+from unittest.mock import patch, MagicMock
+
+import memory
+from memory import MemoryTracker
+
+
+class MockGc:
+    """Simulate micropython's gc module. Set alive and garbage to bytes
+    allocated by live objects and by garbage not collected yet."""
+    def __init__(self, heap_size=40000):
+        self.heap_size = heap_size
+        self.alive = 0
+        self.garbage = 0
+        self.enable = MagicMock()
+        self.threshold = MagicMock()
+
+    def collect(self):
+        self.garbage = 0
+
+    def mem_alloc(self):
+        return self.alive + self.garbage
+
+    def mem_free(self):
+        return self.heap_size - self.mem_alloc()
+
+
+def test_cpython_allocation():
+    tracker = MemoryTracker()
+    data = [bytearray(1000) for _ in range(10)]
+    free_allocated = tracker.checkpoint('allocate')
+    del data
+    tracker.checkpoint('release')
+
+    phase, min_free, free, allocated = tracker.phases[0]
+    assert_equal(phase, 'allocate')
+    assert_equal(min_free, free_allocated)
+    assert_less_equal(min_free, free)
+    assert_greater_equal(allocated, 10000)
+    assert_less_equal(tracker.phases[1][3], -10000)
+    assert_greater_equal(tracker.phases[1][2] - free, 10000)
+    assert_less_equal(tracker.min_free, free_allocated)
+    assert_equal(tracker.collections, 3)
+
+
+def test_cpython_low_heap():
+    tracker = MemoryTracker()
+    data = bytearray(memory.SIMULATED_HEAP_SIZE)
+    tracker.checkpoint('allocate')
+    assert_less(tracker.min_free, memory.LOW_HEAP_WARNING)
+    assert_false(tracker.finish())
+    del data
+
+
+def test_cpython_short_lived_peak():
+    tracker = MemoryTracker()
+    data = bytearray(30000)
+    del data
+    tracker.checkpoint('send')
+
+    phase, min_free, free, allocated = tracker.phases[0]
+    assert_less(min_free, memory.LOW_HEAP_WARNING)
+    assert_greater(free - min_free, 25000)
+    assert_false(tracker.finish())
+    assert_equal(tracker.history[-1], (1, min_free))
+
+
+def test_short_lived_peak():
+    mock_gc = MockGc(heap_size=40000)
+    with patch('memory.gc', mock_gc):
+        tracker = MemoryTracker()
+        # e.g. a large response, freed but not collected yet
+        mock_gc.alive, mock_gc.garbage = 1000, 36000
+        tracker.checkpoint('send')
+    assert_equal(tracker.phases, [('send', 3000, 39000, 37000)])
+    assert_false(tracker.finish())
+
+
+def test_checkpoints():
+    mock_gc = MockGc(heap_size=40000)
+    with patch('memory.gc', mock_gc):
+        tracker = MemoryTracker()
+        mock_gc.alive, mock_gc.garbage = 4000, 6000
+        tracker.checkpoint('measure')
+        mock_gc.alive, mock_gc.garbage = 1000, 2000
+        tracker.checkpoint('send')
+
+        assert_equal(tracker.phases, [('measure', 30000, 36000, 10000),
+                                      ('send', 37000, 39000, -1000)])
+        assert_equal(tracker.min_free, 30000)
+        assert_true(tracker.finish())
+
+        tracker.reset()
+        mock_gc.alive = 1500
+        tracker.checkpoint('measure')
+
+    assert_equal(tracker.phases, [('measure', 38500, 38500, 500)])
+    assert_equal(tracker.min_free, 38500)
+    assert_equal(tracker.min_free_total, 30000)
+    assert_equal(tracker.collections, 5)
+    assert_equal(tracker.cycles, 1)
+
+
+def test_low_heap():
+    mock_gc = MockGc(heap_size=40000)
+    with patch('memory.gc', mock_gc):
+        tracker = MemoryTracker()
+        mock_gc.alive = 40000 - memory.LOW_HEAP_WARNING + 1
+        tracker.checkpoint('send')
+    assert_false(tracker.finish())
+    assert_in('send={}/'.format(memory.LOW_HEAP_WARNING - 1),
+              tracker.summary())
+
+
+def test_setup_gc_threshold():
+    mock_gc = MockGc(heap_size=50000)
+    mock_gc.alive = 2000
+    with patch('memory.gc', mock_gc):
+        memory.setup_gc()
+    mock_gc.enable.assert_called_once_with()
+    mock_gc.threshold.assert_called_once_with(14000)
+
+
+def test_reset_discards_aborted_cycle():
+    mock_gc = MockGc(heap_size=40000)
+    with patch('memory.gc', mock_gc):
+        tracker = MemoryTracker()
+        mock_gc.alive = 4000
+        tracker.checkpoint('measure')
+        # cycle aborted, no finish()
+        tracker.reset()
+        mock_gc.alive = 5000
+        tracker.checkpoint('measure')
+
+    assert_equal(tracker.phases, [('measure', 35000, 35000, 1000)])
+    assert_equal(tracker.min_free, 35000)
+    assert_equal(tracker.cycles, 0)
+
+
+def test_history():
+    mock_gc = MockGc(heap_size=40000)
+    with patch('memory.gc', mock_gc):
+        tracker = MemoryTracker()
+        for cycle in range(1, 13):
+            mock_gc.alive = cycle * 100
+            tracker.checkpoint('send')
+            tracker.finish()
+            tracker.reset()
+
+    assert_equal(len(tracker.history), memory.HISTORY_LENGTH)
+    assert_equal(tracker.history[0], (3, 39700))
+    assert_equal(tracker.history[-1], (12, 38800))
+    assert_equal(tracker.min_free_total, 38800)
@@ -0,0 +1,163 @@
+from nose.tools import *
+
+import schedule
+from schedule import (slot_offset, seconds_until_slot, seconds_until_start,
+                      next_wake, split_sleep, rtc_factor, retry_delay,
+                      parse_backoff)
+
+
+def test_slot_offset_deterministic():
+    mac = b'\x5c\xcf\x7f\x01\x02\x03'
+    assert_equal(slot_offset(mac, 600), slot_offset(mac, 600))
+    assert_equal(slot_offset('kitchen', 600), slot_offset(b'kitchen', 600))
+    assert_not_equal(slot_offset(mac, 600),
+                     slot_offset(b'\x5c\xcf\x7f\x01\x02\x04', 600))
+
+
+def test_slot_offset_spread():
+    period = 600
+    offsets = [slot_offset(bytes([0x5c, 0xcf, 0x7f, 0, i // 256, i % 256]),
+                           period)
+               for i in range(600)]
+    assert_true(all(0 <= offset < period for offset in offsets))
+    # every tenth of the period gets a reasonable share of nodes
+    buckets = [0] * 10
+    for offset in offsets:
+        buckets[offset * 10 // period] += 1
+    assert_true(min(buckets) > 30)
+
+
+def test_seconds_until_slot():
+    # cycle duration does not matter, wake is aligned to the slot
+    assert_equal(seconds_until_slot(6000 + 30, 600, 100), 70)
+    assert_equal(seconds_until_slot(6000 + 35, 600, 100), 65)
+    # just after slot
+    assert_equal(seconds_until_slot(6000 + 110, 600, 100), 590)
+
+
+def test_seconds_until_slot_woke_early():
+    # woke up a bit early, slot already served, wait for the next one
+    assert_equal(seconds_until_slot(6000 + 95, 600, 100), 605)
+    assert_equal(seconds_until_slot(6000 + 95, 600, 100, min_sleep=0), 5)
+
+
+def test_seconds_until_start():
+    # woken up by the alarm at or slightly after the slot
+    assert_equal(seconds_until_start(6000 + 100, 600, 100), 0)
+    assert_equal(seconds_until_start(6000 + 159, 600, 100), 0)
+    # powered up shortly before the slot, reached it during the 10s reflash
+    # window, no need to wait for the next one
+    assert_equal(seconds_until_start(6000 + 95 + 10, 600, 100), 0)
+    # power up, reset or network outage
+    assert_equal(seconds_until_start(6000 + 160, 600, 100), 540)
+    assert_equal(seconds_until_start(6000 + 30, 600, 100), 70)
+    assert_equal(seconds_until_start(6000 + 30, 600, 100, tolerance=0), 70)
+
+
+def test_next_wake_backoff():
+    assert_equal(next_wake(6000 + 30, 600, 100), 70)
+    assert_equal(next_wake(6000 + 30, 600, 100, backoff=None), 70)
+    # backoff shorter than time until slot does not matter
+    assert_equal(next_wake(6000 + 30, 600, 100, backoff=60), 70)
+    # otherwise the next slot after backoff is used
+    assert_equal(next_wake(6000 + 30, 600, 100, backoff=120), 670)
+
+
+def test_next_wake_backoff_capped():
+    max_backoff = schedule.MAX_BACKOFF_PERIODS * 600
+    assert_equal(next_wake(6000 + 30, 600, 100, backoff=99999),
+                 max_backoff + 70)
+    assert_less(next_wake(6000 + 30, 600, 100, backoff=99999),
+                (schedule.MAX_BACKOFF_PERIODS + 1) * 600)
+
+
+def test_split_sleep():
+    assert_equal(split_sleep(70), (70, 0))
+    assert_equal(split_sleep(schedule.MAX_ALARM_S),
+                 (schedule.MAX_ALARM_S, 0))
+
+
+def test_split_sleep_large_period():
+    # back-off with a large period exceeds the range of the RTC alarm
+    sleep_s = next_wake(18000 + 107, 1800, 100, backoff=99999)
+    assert_equal(sleep_s, 2 * 1800 + 1793)
+    alarm_s, remaining_s = split_sleep(sleep_s)
+    assert_equal(alarm_s, schedule.MAX_ALARM_S)
+    assert_equal(split_sleep(remaining_s), (remaining_s, 0))
+
+    # a tenth of the period as minimum sleep exceeds it too
+    sleep_s = next_wake(39000 - 286, 3900, 100)
+    assert_equal(sleep_s, 4286)
+    assert_greater(sleep_s, schedule.MAX_ALARM_S)
+    alarm_s, remaining_s = split_sleep(sleep_s)
+    assert_equal(alarm_s + remaining_s, sleep_s)
+    assert_less_equal(alarm_s, schedule.MAX_ALARM_S)
+
+
+def test_split_sleep_rtc_factor():
+    # RTC runs fast, i.e. an alarm second is shorter than a real second
+    assert_equal(split_sleep(590, factor=0.95), (621, 0))
+    # RTC runs slow
+    assert_equal(split_sleep(590, factor=1.05), (562, 0))
+    alarm_s, remaining_s = split_sleep(5000, factor=1.05)
+    assert_equal(alarm_s, schedule.MAX_ALARM_S)
+    assert_equal(remaining_s, 5000 - 4410)
+
+
+def test_rtc_factor():
+    # alarm set to 600s fired after 570s real time
+    assert_almost_equal(rtc_factor(570, 600), (1. + 0.95) / 2)
+    factor = 1.
+    for _ in range(20):
+        factor = rtc_factor(570, 600, factor)
+    assert_almost_equal(factor, 0.95, places=4)
+    # corrected alarm hits the slot
+    alarm_s, _ = split_sleep(590, factor)
+    assert_less(abs(alarm_s * 0.95 - 590), 1)
+
+
+def test_rtc_factor_implausible():
+    # e.g. a long wait for the network or no alarm set
+    assert_equal(rtc_factor(3000, 600, 0.97), 0.97)
+    assert_equal(rtc_factor(100, 600, 0.97), 0.97)
+    assert_equal(rtc_factor(100, 0, 0.97), 0.97)
+
+
+def test_retry_delay_grows():
+    delays = [retry_delay(attempt, 0) for attempt in range(4)]
+    assert_equal(delays, [3, 6, 12, 24])
+    delays = [retry_delay(attempt, 100) for attempt in range(4)]
+    assert_equal(delays, [3 + 1, 6 + 4, 12 + 4, 24 + 4])
+
+
+def test_retry_delay_spread():
+    # nodes failing at the same time retry at different times
+    offsets = [slot_offset(bytes([0x5c, 0xcf, 0x7f, 0, 0, i]), 600)
+               for i in range(100)]
+    for attempt in range(1, 4):
+        delay = schedule.RETRY_BASE_S * 2 ** attempt
+        delays = set(retry_delay(attempt, offset) for offset in offsets)
+        assert_true(delays <= set(range(delay, 2 * delay)))
+        assert_greater(len(delays), delay * 3 // 4)
+
+
+def test_parse_backoff():
+    assert_is_none(parse_backoff('HTTP/1.1 200 OK\r\n\r\n1'))
+    assert_is_none(parse_backoff('HTTP/1.1 500 Internal Server Error\r\n'
+                                 'Retry-After: 30\r\n\r\n'))
+    assert_is_none(parse_backoff(''))
+    assert_equal(parse_backoff('HTTP/1.1 429 Too Many Requests\r\n'
+                               'Content-Type: text/plain\r\n'
+                               'retry-after:  120\r\n\r\n'), 120)
+    assert_equal(parse_backoff('HTTP/1.1 503 Service Unavailable\r\n'
+                               'Retry-After: 30\r\n\r\n'), 30)
+
+
+def test_parse_backoff_default():
+    assert_equal(parse_backoff('HTTP/1.1 503 Service Unavailable\r\n\r\n'
+                               'Retry-After: 30'),
+                 schedule.DEFAULT_BACKOFF_S)
+    assert_equal(parse_backoff('HTTP/1.1 429 Too Many Requests\r\n'
+                               'Retry-After: Wed, 21 Oct 2015 07:28:00 GMT'
+                               '\r\n\r\n'),
+                 schedule.DEFAULT_BACKOFF_S)